@@ -42,32 +42,116 @@ pont talvi net
 http://dx.doi.org/10.1046/j.0956-540x.2001.01558.x
 """
 
-import tkinter
 import os
-from matplotlib import pyplot
 import re
+import mmap
 from math import sqrt, erf
-from numpy import pi, exp, log10, array, arange
+from numpy import pi, exp, log10, array, asarray, diff, \
+    empty_like, float64, argmax, loadtxt, genfromtxt, isnan, nan, \
+    linspace
 import argparse
 from os.path import basename
-from tkinter.filedialog import askopenfilename
+
+# Line formats in IrmUnmix output files
+_RE_SIRM = re.compile(rb"^ True SIRM= +([0-9.E+-]+)", re.M)
+_RE_COMPONENT_HEADER = re.compile(rb"^ Component", re.M)
+_RE_COMPONENT = re.compile(rb"^ Component[^\n]*\n"
+                           rb" Abs Cont= +([0-9.E+-]+)[^\n]*\n"
+                           rb" Rel Cont= +([0-9.E+-]+) +Mean= +([0-9.E+-]+) +"
+                           rb"DP= +([0-9.E+-]+)", re.M)
+
+# Placeholder for the Numba kernels, which are compiled on first use
+# (Numba is optional and slow to import)
+_NOT_BUILT = object()
+_gradient_kernel = _NOT_BUILT
+_eval_clg = _NOT_BUILT
+
+# log10(field) values at which fitted curves are plotted
+_PLOT_XS = linspace(0.1, 3.0, round((3.0 - 0.1) / 0.02) + 1)
+
+
+def _build_gradient_kernel():
+    """Compile the single-pass kernel behind gradient(), returning None if
+    Numba is not installed."""
+    try:
+        from numba import njit
+    except ImportError:
+        return None
+
+    @njit(cache=True, error_model="numpy")
+    def gradient_kernel(xs, ys, out):
+        """Fill out with the gradients of ys against xs in a single pass."""
+        n = xs.shape[0]
+        for i in range(1, n - 1):
+            out[i] = 0.5 * ((ys[i + 1] - ys[i]) / (xs[i + 1] - xs[i]) +
+                            (ys[i] - ys[i - 1]) / (xs[i] - xs[i - 1]))
+        out[0] = (ys[1] - ys[0]) / (xs[1] - xs[0])
+        out[n - 1] = (ys[n - 1] - ys[n - 2]) / (xs[n - 1] - xs[n - 2])
+
+    return gradient_kernel
+
+
+def _get_gradient_kernel():
+    """Return the gradient kernel (or None), compiling it on first use."""
+    global _gradient_kernel
+    if _gradient_kernel is _NOT_BUILT:
+        _gradient_kernel = _build_gradient_kernel()
+    return _gradient_kernel
+
+
+def _build_eval_clg():
+    """Compile the gufunc behind IrmCurves.evaluate_array, returning None
+    if Numba is not installed."""
+    try:
+        from numba import guvectorize
+    except ImportError:
+        return None
+
+    @guvectorize(["void(float64[:], float64[:], float64[:], float64, "
+                  "float64[:])"],
+                 "(k),(k),(k),()->()", nopython=True, target="parallel",
+                 cache=True)
+    def eval_clg(a, b, c, x, out):
+        """Write the sum of the Gaussians (a, b, c) at x to out."""
+        total = 0.0
+        for j in range(a.shape[0]):
+            z = (x - b[j]) / c[j]
+            total += a[j] * exp(-0.5 * z * z)
+        out[0] = total
+
+    return eval_clg
+
+
+def _get_eval_clg():
+    """Return the evaluation gufunc (or None), compiling it on first use."""
+    global _eval_clg
+    if _eval_clg is _NOT_BUILT:
+        _eval_clg = _build_eval_clg()
+    return _eval_clg
 
 
 def gradient(xs, ys):
-    """Return a new array containing the gradients at all the x points"""
-    result = []
-    for i in range(0, len(xs)):
-        grad1, grad2 = None, None
-        if i < len(xs) - 1:
-            grad1 = (ys[i + 1] - ys[i]) / (xs[i + 1] - xs[i])
-        if i > 0:
-            grad2 = (ys[i] - ys[i - 1]) / (xs[i] - xs[i - 1])
-        if grad1 is None:
-            grad1 = grad2
-        if grad2 is None:
-            grad2 = grad1
-        result.append((grad1 + grad2) / 2)
-    return array(result)
+    """Return a new array containing the gradients at all the x points.
+
+    Interior points get the mean of the gradients to either side; the
+    endpoints get the one-sided gradient.
+    """
+    xs = asarray(xs, dtype=float64)
+    ys = asarray(ys, dtype=float64)
+    if len(xs) != len(ys):
+        raise ValueError("xs and ys must be of equal length")
+    if len(xs) < 2:
+        raise ValueError("at least two points are needed")
+    result = empty_like(xs)
+    gradient_kernel = _get_gradient_kernel()
+    if gradient_kernel is not None:
+        gradient_kernel(xs, ys, result)
+        return result
+    grads = diff(ys) / diff(xs)
+    result[1:-1] = 0.5 * (grads[:-1] + grads[1:])
+    result[0] = grads[0]
+    result[-1] = grads[-1]
+    return result
 
 
 def x_for_half_max_y(xs, ys):
@@ -81,21 +165,60 @@ def x_for_half_max_y(xs, ys):
     :return:
     """
 
+    xs = asarray(xs, dtype=float64)
+    ys = asarray(ys, dtype=float64)
     if len(xs) != len(ys):
         raise ValueError("xs and ys must be of equal length")
-
-    half_max_y = max(ys) / 2
-    for i in range(len(xs)-1):
-        if ys[i+1] >= half_max_y:
-            x_dist = xs[i+1] - xs[i]
-            y_dist = ys[i+1] - ys[i]
-            y_offset = half_max_y - ys[i]
-            if y_offset == 0:
-                return xs[i]
-            else:
-                x_offset = y_offset / y_dist * x_dist
-                return xs[i] + x_offset
-    return None
+    if len(xs) < 2:
+        return None
+
+    half_max_y = ys.max() / 2
+    reached = ys[1:] >= half_max_y
+    if not reached.any():
+        return None
+    i = int(argmax(reached))  # the crossing lies between xs[i] and xs[i+1]
+    y_offset = half_max_y - ys[i]
+    if y_offset == 0:
+        return float(xs[i])
+    x_offset = y_offset / (ys[i + 1] - ys[i]) * (xs[i + 1] - xs[i])
+    return float(xs[i] + x_offset)
+
+
+def _read_two_cols(filename, col1, col2):
+    """Return the numeric rows of two columns of a whitespace-delimited
+    text file as an n-by-2 array. Non-numeric rows are dropped. Rows
+    with a field value but no magnetization value are dropped with a
+    warning."""
+
+    try:
+        return loadtxt(filename, usecols=(col1, col2), ndmin=2)
+    except ValueError:
+        pass  # the file contains non-numeric lines: use a lenient reader
+
+    try:
+        import pandas  # deferred: slow to import
+    except ImportError:
+        pandas = None  # pandas is optional: use NumPy's genfromtxt
+
+    if pandas is not None:
+        try:
+            raw = pandas.read_csv(filename, sep=r"\s+", header=None,
+                                  usecols=[col1, col2], engine="c",
+                                  on_bad_lines="skip",
+                                  keep_default_na=False)
+            frame = raw.apply(pandas.to_numeric, errors="coerce")
+            # Without NA parsing, absent fields are read as empty strings
+            missing = frame[col1].notna() & (raw[col2] == "")
+            for position in frame[col1][missing]:
+                print("WARNING: missing data at " + str(position))
+            return frame[[col1, col2]].dropna().to_numpy(dtype=float64)
+        except (ValueError, TypeError):
+            pass  # fall back to genfromtxt; TypeError from pandas < 1.3
+
+    # genfromtxt itself warns about rows lacking a column
+    data = genfromtxt(filename, usecols=(col1, col2),
+                      invalid_raise=False, filling_values=nan, ndmin=2)
+    return data[~isnan(data).any(axis=1)]
 
 
 class DataSeries:
@@ -118,42 +241,32 @@ class DataSeries:
     def read_file(filename, col1=0, col2=1, name=None):
         """Reads a series from a two-column whitespace-delimited text file. If
         there are more than two columns, the extra ones are ignored. If there
-        is a header line (or any other non-numeric line), it is ignored."""
-
-        rows = []
-        # "U" for universal newlines
-        with open(filename, "U") as fh:
-            for line in fh.readlines():
-                parts = line.split()
-                try:
-                    position = float(parts[col1])
-                    if len(parts) > col2:
-                        value = float(parts[col2])
-                    else:
-                        print("WARNING: missing data at " + str(position))
-                        value = 0
-                    rows.append([position, value])
-                except ValueError:
-                    pass  # ignore non-numeric lines
-        data = array(rows).transpose()
+        is a header line (or any other non-numeric line), it is ignored.
+        A line with a field value but no magnetization value is skipped,
+        and a warning is given."""
+
+        data = _read_two_cols(filename, col1, col2).transpose()
         return DataSeries(data, name=name, filename=filename)
 
 
 class Gaussian:
+    __slots__ = ("m_abs", "m", "a", "bhalf", "dp", "_cdf_scale")
+
     def __init__(self, m_abs, m, bhalf, dp):
         self.m_abs = m_abs  # absolute contribution (not used)
         self.m = m  # relative contribution (size of peak)
         self.a = m / (dp * (2 * pi) ** 0.5)  # corrected for dispersion
         self.bhalf = bhalf  # mean log of field (position of peak)
         self.dp = dp  # dispersion parameter (width of peak)
+        self._cdf_scale = 1.0 / (dp * sqrt(2.0))  # erf argument scaling
 
     def evaluate(self, x):
+        """Evaluate the Gaussian at x, which may be a scalar or an array."""
         (a, b, c) = (self.a, self.bhalf, self.dp)
         return a * exp(-(((x - b) ** 2) / (2 * (c ** 2))))
 
     def cdf(self, x):
-        (a, b, c) = (self.a, self.bhalf, self.dp)
-        return 0.5 * (1 + erf((x - b) / (sqrt(2 * c ** 2))))
+        return 0.5 * (1.0 + erf((x - self.bhalf) * self._cdf_scale))
 
     def to_csv_line(self):
         return "%.2f,%.2f,%.2f,%.2f,%.2f" % \
@@ -173,32 +286,64 @@ class IrmCurves:
         self.name = name
         self.sirm = sirm
         self.components = [Gaussian(*p) for p in params]
+        # Component parameters as contiguous rows (a, bhalf, dp), for
+        # the evaluation methods.
+        self._params = array([[g.a for g in self.components],
+                              [g.bhalf for g in self.components],
+                              [g.dp for g in self.components]],
+                             dtype=float64).reshape(3, len(self.components))
+        self._a, self._b, self._c = self._params
 
     def evaluate(self, x, normalize=False):
-        result = sum([g.evaluate(x) for g in self.components])
+        """Evaluate the sum of the components at x, which may be a scalar
+        or an array."""
+        x = asarray(x, dtype=float64)
+        return self.evaluate_array(x.ravel(), normalize).reshape(x.shape)[()]
+
+    def evaluate_components(self, xs):
+        """Evaluate every component at every x value in a single pass.
+
+        :param xs: 1-D array of x values
+        :return: a matrix with one row per component and one column per
+            x value (not scaled by the SIRM)
+        """
+        xs = asarray(xs, dtype=float64)
+        z = (xs[None, :] - self._b[:, None]) / self._c[:, None]
+        return self._a[:, None] * exp(-0.5 * z * z)
+
+    def evaluate_array(self, xs, normalize=False):
+        """Evaluate the sum of the components at every x value in xs.
+
+        :param xs: 1-D array of x values
+        :param normalize: if False, scale the result by the SIRM
+        :return: an array of the same length as xs
+        """
+        eval_clg = _get_eval_clg()
+        if eval_clg is not None:
+            result = eval_clg(self._a, self._b, self._c,
+                              asarray(xs, dtype=float64))
+        else:
+            result = self.evaluate_components(xs).sum(axis=0)
         if not normalize:
             result = result * self.sirm
         return result
 
     @staticmethod
     def read_file(filename):
-        re1 = re.compile(r"^ True SIRM= +([0-9.E-]+)")
-        re2 = re.compile(r"^ Abs Cont= +([0-9.E-]+)")
-        re3 = re.compile(r"^ Rel Cont= +([0-9.E-]+) +Mean= +([0-9.E-]+) +" +
-                         r"DP= +([0-9.E-]+)\s+$")
-        infile = open(filename)
-        sirm = float(re1.search(infile.readline()).groups()[0])
-        params = []
-        infile.readline()
-        while True:
-            comp = infile.readline()
-            if not comp.startswith(" Component"):
-                break
-            param = [float(re2.search(infile.readline()).groups()[0])]
-            line3 = infile.readline()
-            param += map(float, re3.search(line3).groups())
-            params.append(param)
-            infile.readline()  # skip blank line
+        with open(filename, "rb") as fh:
+            if os.fstat(fh.fileno()).st_size == 0:
+                raise ValueError("No SIRM found in {}".format(filename))
+            with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                sirm_match = _RE_SIRM.search(buf)
+                if sirm_match is None:
+                    raise ValueError("No SIRM found in {}".format(filename))
+                sirm = float(sirm_match.group(1))
+                components = _RE_COMPONENT.findall(buf)
+                n_headers = len(_RE_COMPONENT_HEADER.findall(buf))
+        if n_headers != len(components):
+            raise ValueError("Incomplete component found in {}".format(
+                filename))
+        params = [[float(x) for x in component] for component in components]
         return IrmCurves(basename(filename), sirm, params)
 
     def to_csv_line(self):
@@ -212,23 +357,24 @@ class IrmCurves:
 
 
 def plot_clg_fit(series, curves, output_filename=None):
+    from matplotlib import pyplot  # deferred: slow to import
+
     sirm = 1
     if curves:
         sirm = curves.sirm
 
     if series:
-        xs = list(map(log10, series.data[0][1:]))
+        xs = log10(series.data[0][1:])
         ys = series.data[1][1:]
         pyplot.plot(xs, gradient(xs, ys) / sirm, marker="o",
                     ls="", color="black", markerfacecolor="none", markersize=6)
 
     if curves:
-        xs = arange(0.1, 3, 0.02)
-        ys = [curves.evaluate(x, True) for x in xs]
-        pyplot.plot(xs, ys, linewidth=1.0, color="black")
-        for curve in curves.components:
-            ys2 = [curve.evaluate(x) for x in xs]
-            pyplot.plot(xs, ys2, linewidth=0.5, color="black")
+        xs = _PLOT_XS
+        components = curves.evaluate_components(xs)
+        pyplot.plot(xs, components.sum(axis=0), linewidth=1.0, color="black")
+        for ys in components:
+            pyplot.plot(xs, ys, linewidth=0.5, color="black")
 
     pyplot.ylim(ymin=0)
     pyplot.xlabel("log10(Applied field (mT))")
@@ -243,6 +389,7 @@ def plot_clg_fit(series, curves, output_filename=None):
 class App:
     def __init__(self, master, data=None, curves=None,
                  plot_now=False):
+        import tkinter
 
         self.series = data
         self.curves = curves
@@ -283,12 +430,14 @@ class App:
             self.plot()
 
     def choose_curves_file(self):
+        from tkinter.filedialog import askopenfilename
         input_file = \
             askopenfilename(title="Select IrmUnmix parameter file")
         if input_file:
             self.curves = IrmCurves.read_file(input_file)
 
     def choose_data_file(self):
+        from tkinter.filedialog import askopenfilename
         input_file = askopenfilename(title="Select IRM data file")
         if input_file:
             self.series = DataSeries.read_file(input_file)
@@ -325,6 +474,7 @@ def main():
         plot_clg_fit(data, curves, args.output)
 
     if not args.no_gui:
+        import tkinter
         root = tkinter.Tk()
         App(root, data=data, curves=curves,
             plot_now=args.plot_now)
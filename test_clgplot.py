@@ -1,8 +1,19 @@
 #!/usr/bin/env python3
 
+import io
+import os
+import tempfile
 import unittest
+import warnings
+from contextlib import redirect_stdout
+from importlib.util import find_spec
+from unittest import mock
+import numpy
+import clgplot
 from clgplot import gradient
 from clgplot import x_for_half_max_y
+from clgplot import IrmCurves
+from clgplot import DataSeries
 
 
 class TestClgPlot(unittest.TestCase):
@@ -12,6 +23,23 @@ class TestClgPlot(unittest.TestCase):
         self.assertEqual(2, result[0])
         self.assertEqual(2, result[1])
 
+    def test_gradient_uneven_spacing(self):
+        # Interior points take the plain mean of the two one-sided
+        # gradients, which differs from numpy.gradient's second-order
+        # estimate when the x spacing is uneven.
+        result = gradient([0, 1, 3], [0, 1, 5])
+        self.assertEqual([1, 1.5, 2], list(result))
+
+    def test_gradient_repeated_x(self):
+        # A repeated x value gives infinite gradients rather than an
+        # exception, whether or not the Numba kernel is in use.
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            result = gradient([1, 1, 2], [0, 1, 2])
+            with mock.patch.object(clgplot, "_gradient_kernel", None):
+                expected = gradient([1, 1, 2], [0, 1, 2])
+        numpy.testing.assert_array_equal(expected, result)
+        numpy.testing.assert_array_equal([numpy.inf, numpy.inf, 1], result)
+
     def test_x_for_half_max_y(self):
         self.assertEqual(0, x_for_half_max_y([0, 0, 0], [0, 0, 0]))
         self.assertEqual(5, x_for_half_max_y([1, 2, 5, 16, 19, 99],
@@ -23,6 +51,133 @@ class TestClgPlot(unittest.TestCase):
                                                       [0, 1, 5, 8]),
                                places=10)
 
+    def test_irm_curves_evaluate_array(self):
+        curves = IrmCurves("test", 2.0, [[0.4, 0.4, 1.5, 0.3],
+                                         [0.6, 0.6, 2.0, 0.2]])
+        xs = [0.5, 1.5, 1.75, 2.0, 2.5]
+        result = curves.evaluate_array(xs)
+        self.assertEqual(len(xs), len(result))
+        for x, y in zip(xs, result):
+            expected = 2.0 * sum(g.evaluate(x) for g in curves.components)
+            self.assertAlmostEqual(expected, y, places=10)
+
+    def test_irm_curves_numpy_fallback(self):
+        # The NumPy paths, used when Numba is not installed, agree with
+        # whichever implementation is currently active.
+        curves = IrmCurves("test", 2.0, [[0.4, 0.4, 1.5, 0.3],
+                                         [0.6, 0.6, 2.0, 0.2]])
+        xs = numpy.linspace(0.1, 3.0, 30)
+        ys = curves.evaluate_array(xs)
+        gradients = gradient(xs, ys)
+        with mock.patch.object(clgplot, "_eval_clg", None), \
+                mock.patch.object(clgplot, "_gradient_kernel", None):
+            numpy.testing.assert_allclose(curves.evaluate_array(xs), ys,
+                                          rtol=1e-12)
+            numpy.testing.assert_allclose(gradient(xs, ys), gradients,
+                                          rtol=1e-12)
+
+    def test_irm_curves_evaluate_shapes(self):
+        curves = IrmCurves("test", 2.0, [[0.4, 0.4, 1.5, 0.3],
+                                         [0.6, 0.6, 2.0, 0.2]])
+        expected = 2.0 * sum(g.evaluate(1.6) for g in curves.components)
+        result = curves.evaluate(1.6)
+        self.assertEqual((), numpy.shape(result))
+        self.assertAlmostEqual(expected, result, places=10)
+        grid = numpy.array([[0.5, 1.6], [2.0, 2.5]])
+        result = curves.evaluate(grid, True)
+        self.assertEqual((2, 2), result.shape)
+        self.assertAlmostEqual(expected / 2.0, result[0, 1], places=10)
+        numpy.testing.assert_allclose(curves.evaluate_array([2.0, 2.5], True),
+                                      result[1], rtol=1e-12)
+
+    def test_data_series_read_file(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "data.txt")
+            with open(filename, "w") as fh:
+                fh.write("field moment\n1 0.5\n10 2.5 9\n100 4\n")
+            series = DataSeries.read_file(filename)
+        self.assertEqual("data.txt", series.name)
+        self.assertEqual([[1, 10, 100], [0.5, 2.5, 4]],
+                         series.data.tolist())
+
+    def test_data_series_read_file_missing_value(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "data.txt")
+            with open(filename, "w") as fh:
+                fh.write("field moment\n1 0.5\n10\n100 4\n")
+            output = io.StringIO()
+            with warnings.catch_warnings(record=True) as caught, \
+                    redirect_stdout(output):
+                warnings.simplefilter("always")
+                series = DataSeries.read_file(filename)
+        self.assertEqual([[1, 100], [0.5, 4]], series.data.tolist())
+        if find_spec("pandas") is not None:
+            self.assertIn("WARNING: missing data at 10", output.getvalue())
+        else:
+            # numpy does not export ConversionWarning publicly
+            self.assertTrue(any(
+                w.category.__name__ == "ConversionWarning" and
+                "Line #3 " in str(w.message) for w in caught))
+
+    @unittest.skipIf(find_spec("pandas") is None, "pandas not installed")
+    def test_data_series_read_file_nan_value(self):
+        # A value that is present but not a number is dropped without
+        # the missing-data warning.
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "data.txt")
+            with open(filename, "w") as fh:
+                fh.write("field moment\n1 nan\n10 2.5\n")
+            output = io.StringIO()
+            with redirect_stdout(output):
+                series = DataSeries.read_file(filename)
+        self.assertEqual([[10], [2.5]], series.data.tolist())
+        self.assertEqual("", output.getvalue())
+
+    def test_irm_curves_read_file(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "curves.txt")
+            with open(filename, "w") as fh:
+                fh.write(" True SIRM=   1.000E-01\n\n"
+                         " Component 1\n Abs Cont=   4.000E-02\n"
+                         " Rel Cont=  0.40 Mean=  1.50 DP=  0.30   \n\n"
+                         " Component 2\n Abs Cont=   6.000E-02\n"
+                         " Rel Cont=  0.60 Mean=  2.00 DP=  0.20   \n\n")
+            curves = IrmCurves.read_file(filename)
+        self.assertEqual("curves.txt", curves.name)
+        self.assertAlmostEqual(0.1, curves.sirm)
+        self.assertEqual("curves.txt,0.04,0.40,0.53,1.50,0.30,"
+                         "0.06,0.60,1.20,2.00,0.20", curves.to_csv_line())
+
+    def test_irm_curves_read_file_bad_input(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "curves.txt")
+            with open(filename, "w") as fh:
+                fh.write(" True SIRM=   1.000E-01\n\n"
+                         " Component 1\n Abs Cont=   4.000E-02\n"
+                         " Rel Cont=  0.40 Mean=  1.50 DP=  0.30   \n\n"
+                         " Abs Cont=   6.000E-02\n"
+                         " Rel Cont=  0.60 Mean=  2.00 DP=  0.20   \n\n")
+            curves = IrmCurves.read_file(filename)
+            empty_filename = os.path.join(tmpdir, "empty.txt")
+            open(empty_filename, "w").close()
+            with self.assertRaises(ValueError):
+                IrmCurves.read_file(empty_filename)
+        self.assertEqual(1, len(curves.components))
+
+    def test_irm_curves_read_file_corrupt_component(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "curves.txt")
+            with open(filename, "w") as fh:
+                fh.write(" True SIRM=   1.000E-01\n\n"
+                         " Component 1\n Abs Cont=   4.000E-02\n"
+                         " Rel Cont=  0.40 Mean=  1.50 DP=  0.30   \n\n"
+                         " Component 2\n Abs Cont=   1.000E-02\n"
+                         " Rel Cont=  0.10 Mean=  1.80 DP=  ********\n\n"
+                         " Component 3\n Abs Cont=   5.000E-02\n"
+                         " Rel Cont=  0.50 Mean=  2.00 DP=  0.20   \n\n")
+            with self.assertRaises(ValueError):
+                IrmCurves.read_file(filename)
+
 
 if __name__ == "__main__":
     unittest.main()